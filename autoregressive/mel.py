@@ -1,17 +1,55 @@
 import numpy as np
 import torch.nn.functional as F
-import librosa
-from librosa.filters import mel
-from librosa.util import pad_center
-from scipy.signal import get_window
-from torch.autograd import Variable
-from torch import hann_window
 
 from .constants import *
-from time import time
 
 """ Initial code was from https://github.com/jongwook/onsets-and-frames """
 
+# The window and the mel filterbank are computed with numpy and the STFT runs in torch,
+# so that the inference path does not import librosa / scipy (and numba through librosa).
+
+def hann_window(win_length):
+    # periodic hann window, same as scipy.signal.get_window('hann', win_length, fftbins=True)
+    n = np.arange(win_length)
+    return 0.5 - 0.5 * np.cos(2 * np.pi * n / win_length)
+
+
+def pad_center(data, size):
+    lpad = (size - len(data)) // 2
+    return np.pad(data, (lpad, size - len(data) - lpad))
+
+
+def hz_to_mel(frequencies):
+    # HTK mel scale
+    return 2595.0 * np.log10(1.0 + np.asarray(frequencies, dtype=np.float64) / 700.0)
+
+
+def mel_to_hz(mels):
+    return 700.0 * (10.0 ** (np.asarray(mels, dtype=np.float64) / 2595.0) - 1.0)
+
+
+def mel_filterbank(sr, n_fft, n_mels, fmin=0.0, fmax=None):
+    '''
+    same as librosa.filters.mel(sr=sr, n_fft=n_fft, n_mels=n_mels, fmin=fmin, fmax=fmax, htk=True)
+    returns np.ndarray, shape of (n_mels x (1 + n_fft // 2)), slaney-normalized
+    '''
+    if fmax is None:
+        fmax = sr / 2
+    fft_freqs = np.fft.rfftfreq(n=n_fft, d=1.0 / sr)
+    mel_f = mel_to_hz(np.linspace(hz_to_mel(fmin), hz_to_mel(fmax), n_mels + 2))
+    fdiff = np.diff(mel_f)
+    ramps = np.subtract.outer(mel_f, fft_freqs)
+
+    weights = np.zeros((n_mels, len(fft_freqs)), dtype=np.float32)
+    for i in range(n_mels):
+        lower = -ramps[i] / fdiff[i]
+        upper = ramps[i + 2] / fdiff[i + 1]
+        weights[i] = np.maximum(0, np.minimum(lower, upper))
+    enorm = 2.0 / (mel_f[2:n_mels + 2] - mel_f[:n_mels])
+    weights *= enorm[:, np.newaxis]
+    return weights
+
+
 class STFT(torch.nn.Module):
     """adapted from Prem Seetharaman's https://github.com/pseeth/pytorch-stft"""
     def __init__(self, filter_length, hop_length, win_length=None, window='hann', padding=True):
@@ -35,7 +73,8 @@ class STFT(torch.nn.Module):
         if window is not None:
             assert(filter_length >= win_length)
             # get window and zero center pad it to filter_length
-            fft_window = get_window(window, win_length, fftbins=True)
+            assert window == 'hann'
+            fft_window = hann_window(win_length)
             fft_window = pad_center(fft_window, size=filter_length)
             fft_window = torch.from_numpy(fft_window).float()
 
@@ -76,9 +115,11 @@ class MelSpectrogram(torch.nn.Module):
         # self.torchSTFT = torchSTFT
         # self.stft = spectrogram()
 
-        mel_basis = mel(sr=sample_rate, n_fft=filter_length, n_mels=n_mels, fmin=mel_fmin, fmax=mel_fmax, htk=True)
+        mel_basis = mel_filterbank(sample_rate, filter_length, n_mels, fmin=mel_fmin, fmax=mel_fmax)
         mel_basis = torch.from_numpy(mel_basis).float()
         self.register_buffer('mel_basis', mel_basis)
+        # non-persistent: follows .to(device) but the checkpoints have no entry for it
+        self.register_buffer('window', torch.from_numpy(hann_window(filter_length)).float(), persistent=False)
 
     def forward(self, y):
         """Computes mel-spectrograms from a batch of waves
@@ -92,8 +133,8 @@ class MelSpectrogram(torch.nn.Module):
         assert(torch.min(y.data) >= -1)
         assert(torch.max(y.data) <= 1)
         with torch.no_grad():            
-            magnitudes = np.abs(librosa.core.stft(y.numpy()[0], n_fft=WINDOW_LENGTH, hop_length=HOP_LENGTH, center=False))
-            magnitudes = torch.Tensor(magnitudes).unsqueeze(0)
+            magnitudes = torch.stft(y.to(torch.float), n_fft=WINDOW_LENGTH, hop_length=HOP_LENGTH, window=self.window,
+                                    center=False, return_complex=True).abs()
 
             mel_output = torch.matmul(self.mel_basis, magnitudes)
             mel_output = torch.log(torch.clamp(mel_output, min=1e-5))
@@ -80,10 +80,7 @@ class AR_Transcriber(nn.Module):
     def forward(self, mel, gt_label=False): 
         acoustic_out = self.acoustic_model(mel)
         if not isinstance(gt_label, bool):
-            prev_gt = torch.cat((torch.zeros((gt_label.shape[0], 1, gt_label.shape[2]), device=mel.device, dtype=torch.long), gt_label[:, :-1, :].type(torch.LongTensor).to(mel.device)), dim=1)
-            concated_data = torch.cat((acoustic_out, self.class_embedding(prev_gt).view(mel.shape[0], -1, 88 * 2)), dim=2) # [1 640 944]
-            result, _= self.language_model(concated_data) # [1, 640, 1536], [1, 1, 1536], [1, 1, 1536]
-            total_result = self.language_post(result).view(mel.shape[0], -1, 88, 5) # [1, 640, 88, 5]
+            total_result = self.lm_model_teacher_forced(acoustic_out, gt_label)
         else:
             h, c= self.init_lstm_hidden(mel.shape[0], mel.device)
             prev_out =  torch.zeros((mel.shape[0], 1, 88*2)).to(mel.device)
@@ -115,6 +112,18 @@ class AR_Transcriber(nn.Module):
         return current_out, hidden
 
 
+    def lm_model_teacher_forced(self, acoustic_out, gt_label):
+        '''
+        acoustic_out: tensor, shape of (B x T x C)
+        gt_label: tensor, shape of (B x T x pitch), reference state of every frame
+        returns logits of shape (B x T x pitch x 5). Frame t is conditioned on gt_label[:, :t],
+        so the whole sequence runs through the LSTM in a single call.
+        '''
+        prev_gt = torch.cat((torch.zeros((gt_label.shape[0], 1, gt_label.shape[2]), device=acoustic_out.device, dtype=torch.long), gt_label[:, :-1, :].type(torch.LongTensor).to(acoustic_out.device)), dim=1)
+        concated_data = torch.cat((acoustic_out, self.class_embedding(prev_gt).view(acoustic_out.shape[0], -1, 88 * 2)), dim=2) # [1 640 944]
+        result, _= self.language_model(concated_data) # [1, 640, 1536], [1, 1, 1536], [1, 1, 1536]
+        return self.language_post(result).view(acoustic_out.shape[0], -1, 88, 5) # [1, 640, 88, 5]
+
     def init_lstm_hidden(self, batch_size, device):
         h = torch.zeros(2, batch_size, self.language_hidden_size, device=device)
         c = torch.zeros(2, batch_size, self.language_hidden_size, device=device)
@@ -0,0 +1,194 @@
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import time
+from pathlib import Path
+
+import torch as th
+
+from transcribe import load_model, OnlineTranscriber
+from midi_io import write_midi_notes
+from autoregressive.constants import *
+
+""" Batch transcription of a folder or a manifest.
+Results are cached under a hash of the audio content and the model checkpoint, so a rerun,
+or a run resumed after an interruption, only transcribes the files that are not finished yet. """
+
+AUDIO_EXTENSIONS = ('.wav', '.mp3', '.flac', '.ogg', '.m4a', '.aiff', '.aif')
+CHUNK = 512
+CACHE_VERSION = 1
+
+_worker = {}
+
+
+def file_digest(filename, block_size=2**20):
+    h = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def cache_paths(cache_dir, key):
+    prefix = Path(cache_dir) / key[:2] / key
+    return prefix.with_suffix('.json'), prefix.with_suffix('.mid')
+
+
+def collect_audio_files(inputs):
+    '''
+    inputs: directories (walked recursively) and manifests (text file, one audio path per line,
+    relative to the manifest)
+    '''
+    files = []
+    for item in inputs:
+        item = Path(item)
+        if item.is_dir():
+            files += sorted(p for p in item.rglob('*') if p.suffix.lower() in AUDIO_EXTENSIONS)
+        elif item.suffix.lower() in AUDIO_EXTENSIONS:
+            files.append(item)
+        else:
+            with open(item) as f:
+                for line in f:
+                    line = line.strip()
+                    if line and not line.startswith('#'):
+                        files.append(item.parent / line)
+    return files
+
+
+def transcribe_audio(transcriber, y, sr=SAMPLE_RATE):
+    '''
+    streams y through the transcriber hop by hop, like test_model_on_audio.py
+    returns list of notes (onset_sec, offset_sec, midi_pitch, velocity)
+    '''
+    notes = []
+    active = {}
+    n_frames = (len(y) - CHUNK) // CHUNK + 1
+    for i in range(n_frames):
+        onsets, offsets = transcriber.inference(y[i*CHUNK:(i+1)*CHUNK])
+        t = i * CHUNK / sr
+        for pitch in offsets:
+            if pitch in active:
+                notes.append((active.pop(pitch), t, pitch + MIN_MIDI, 64))
+        for pitch in onsets:
+            if pitch in active:
+                notes.append((active.pop(pitch), t, pitch + MIN_MIDI, 64))
+            active[pitch] = t
+    end = len(y) / sr
+    for pitch, onset in active.items():
+        notes.append((onset, end, pitch + MIN_MIDI, 64))
+    notes.sort()
+    return notes
+
+
+def init_worker(model_file, model_digest, cache_dir, torch_threads):
+    th.set_num_threads(torch_threads)
+    _worker['model'] = load_model(model_file)
+    _worker['model_digest'] = model_digest
+    _worker['cache_dir'] = cache_dir
+
+
+def process_file(audio_file):
+    '''
+    returns dict with source, key, duration, number of notes, processing time and whether it was cached,
+    or with source and error if the file could not be transcribed
+    '''
+    try:
+        return _process_file(audio_file)
+    except Exception as e:
+        return {'source': str(audio_file), 'error': repr(e)}
+
+
+def _process_file(audio_file):
+    key = hashlib.sha256('{}:{}:{}'.format(CACHE_VERSION, _worker['model_digest'], file_digest(audio_file)).encode()).hexdigest()
+    json_path, midi_path = cache_paths(_worker['cache_dir'], key)
+    if json_path.exists() and midi_path.exists():
+        with open(json_path) as f:
+            result = json.load(f)
+        return {'source': str(audio_file), 'key': key, 'duration': result['duration'],
+                'num_notes': len(result['notes']), 'elapsed': 0.0, 'cached': True}
+
+    import librosa
+
+    start = time.perf_counter()
+    y, _ = librosa.load(audio_file, sr=SAMPLE_RATE, mono=True)
+    transcriber = OnlineTranscriber(_worker['model'], return_roll=False)
+    notes = transcribe_audio(transcriber, y)
+    elapsed = time.perf_counter() - start
+    duration = len(y) / SAMPLE_RATE
+
+    # write to temporary files first, so that an interrupted job never leaves a partial result behind
+    json_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_suffix = '.tmp{}'.format(os.getpid())
+    write_midi_notes(str(midi_path) + tmp_suffix, notes)
+    with open(str(json_path) + tmp_suffix, 'w') as f:
+        json.dump({'source': str(audio_file), 'duration': duration, 'notes': notes}, f)
+    os.replace(str(midi_path) + tmp_suffix, midi_path)
+    os.replace(str(json_path) + tmp_suffix, json_path)
+    return {'source': str(audio_file), 'key': key, 'duration': duration,
+            'num_notes': len(notes), 'elapsed': elapsed, 'cached': False}
+
+
+def main(args):
+    missing = [item for item in args.inputs if not Path(item).exists()]
+    if missing:
+        sys.exit('Input not found: {}'.format(', '.join(missing)))
+    files = collect_audio_files(args.inputs)
+    if not files:
+        print('No audio files found')
+        return
+    # outputs mirror the layout of the inputs below their common directory
+    root = Path(os.path.commonpath([str(f.resolve().parent) for f in files]))
+    model_digest = file_digest(args.model_file)
+    Path(args.cache_dir).mkdir(parents=True, exist_ok=True)
+    print(f"{len(files)} files, {args.workers} workers, cache at {args.cache_dir}")
+
+    audio_sec = 0.0
+    process_sec = 0.0
+    num_cached = 0
+    failed = []
+    start = time.perf_counter()
+    ctx = multiprocessing.get_context('spawn')
+    with ctx.Pool(args.workers, initializer=init_worker,
+                  initargs=(args.model_file, model_digest, args.cache_dir, args.torch_threads)) as pool:
+        for i, result in enumerate(pool.imap_unordered(process_file, files)):
+            if 'error' in result:
+                failed.append(result['source'])
+                print(f"[{i+1}/{len(files)}] {result['source']}: failed, {result['error']}", flush=True)
+                continue
+            if result['cached']:
+                num_cached += 1
+                status = 'cached'
+            else:
+                audio_sec += result['duration']
+                process_sec += result['elapsed']
+                status = f"RTF {result['elapsed'] / max(result['duration'], 1e-9):.3f}"
+            if args.out_dir:
+                # keep the audio extension, so that x.wav and x.mp3 do not both map to x.mid
+                out_path = Path(args.out_dir) / Path(result['source']).resolve().relative_to(root)
+                out_path = out_path.with_name(out_path.name + '.mid')
+                out_path.parent.mkdir(parents=True, exist_ok=True)
+                shutil.copyfile(cache_paths(args.cache_dir, result['key'])[1], out_path)
+            wall_sec = time.perf_counter() - start
+            aggregate = f"aggregate RTF {process_sec / audio_sec:.3f}, wall RTF {wall_sec / audio_sec:.3f}" if audio_sec else ''
+            print(f"[{i+1}/{len(files)}] {result['source']}: {result['num_notes']} notes, {status} {aggregate}", flush=True)
+
+    print(f"Done: {len(files) - num_cached - len(failed)} transcribed, {num_cached} cached, {len(failed)} failed, "
+          f"{audio_sec:.1f}s of audio in {time.perf_counter() - start:.1f}s")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('inputs', type=str, nargs='+', help='audio files, directories or manifests (one audio path per line)')
+    parser.add_argument('--model_file', type=str, default='model-180000.pt')
+    parser.add_argument('--cache_dir', type=str, default='transcription_cache')
+    parser.add_argument('--out_dir', type=str, default=None, help='copy the MIDI of every input here')
+    parser.add_argument('--workers', type=int, default=max(1, os.cpu_count() // 2))
+    parser.add_argument('--torch_threads', type=int, default=1, help='torch threads per worker')
+    args = parser.parse_args()
+    main(args)
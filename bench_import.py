@@ -0,0 +1,68 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+""" Import-time and RSS benchmark of the inference runtime.
+Each measurement runs in a fresh interpreter. Fails if transcribe.py pulls in a heavyweight
+module or goes over the time / memory budget. """
+
+HEAVY_MODULES = ('librosa', 'scipy', 'numba', 'matplotlib', 'sklearn')
+
+PROBE = '''
+import json, resource, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+max_rss_mb = max_rss / 2**20 if sys.platform == 'darwin' else max_rss / 2**10
+print(json.dumps({{'seconds': elapsed, 'max_rss_mb': max_rss_mb,
+                  'heavy_modules': sorted(set(m.split('.')[0] for m in sys.modules) & set({heavy!r}))}}))
+'''
+
+
+def measure(module, repeat):
+    '''
+    returns the best of `repeat` runs, so that a cold disk cache does not count against the module
+    '''
+    runs = []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, '-c', PROBE.format(module=module, heavy=HEAVY_MODULES)],
+                             check=True, capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+        runs.append(json.loads(out.strip().splitlines()[-1]))
+    return min(runs, key=lambda x: x['seconds'])
+
+
+def main(args):
+    failures = []
+    baseline = measure('torch', args.repeat)
+    result = measure('transcribe', args.repeat)
+    print(f"torch:      {baseline['seconds']:.3f}s, max RSS {baseline['max_rss_mb']:.1f}MB")
+    print(f"transcribe: {result['seconds']:.3f}s, max RSS {result['max_rss_mb']:.1f}MB, heavy modules: {result['heavy_modules']}")
+    if args.compare_librosa:
+        librosa_result = measure('librosa', args.repeat)
+        print(f"librosa:    {librosa_result['seconds']:.3f}s, max RSS {librosa_result['max_rss_mb']:.1f}MB")
+
+    if result['heavy_modules']:
+        failures.append(f"transcribe imports {', '.join(result['heavy_modules'])}")
+    extra_seconds = result['seconds'] - baseline['seconds']
+    extra_rss = result['max_rss_mb'] - baseline['max_rss_mb']
+    if extra_seconds > args.max_extra_seconds:
+        failures.append(f"import takes {extra_seconds:.3f}s more than torch alone (budget {args.max_extra_seconds}s)")
+    if extra_rss > args.max_extra_rss_mb:
+        failures.append(f"import uses {extra_rss:.1f}MB more than torch alone (budget {args.max_extra_rss_mb}MB)")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--max_extra_seconds', type=float, default=0.5, help='import time budget on top of torch')
+    parser.add_argument('--max_extra_rss_mb', type=float, default=30, help='RSS budget on top of torch')
+    parser.add_argument('--compare_librosa', action='store_true')
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,140 @@
+import struct
+
+""" Minimal Standard MIDI File reader and writer for note events """
+
+
+def _read_var_len(data, pos):
+    value = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value = (value << 7) | (byte & 0x7F)
+        if not byte & 0x80:
+            return value, pos
+
+
+def _read_track(data):
+    '''
+    returns list of (tick, kind, channel, a, b)
+    kind: 'on', 'off' or 'tempo' (a = microseconds per quarter note)
+    '''
+    events = []
+    pos = 0
+    tick = 0
+    status = None
+    while pos < len(data):
+        delta, pos = _read_var_len(data, pos)
+        tick += delta
+        byte = data[pos]
+        if byte == 0xFF:  # meta event
+            meta_type = data[pos + 1]
+            length, pos = _read_var_len(data, pos + 2)
+            if meta_type == 0x51:
+                events.append((tick, 'tempo', 0, int.from_bytes(data[pos:pos + 3], 'big'), 0))
+            elif meta_type == 0x2F:
+                break
+            pos += length
+            continue
+        if byte in (0xF0, 0xF7):  # sysex
+            length, pos = _read_var_len(data, pos + 1)
+            pos += length
+            continue
+        if byte & 0x80:
+            status = byte
+            pos += 1
+        elif status is None:
+            raise ValueError('Running status without a preceding status byte')
+        msg_type = status & 0xF0
+        channel = status & 0x0F
+        if msg_type in (0xC0, 0xD0):
+            pos += 1
+            continue
+        a, b = data[pos], data[pos + 1]
+        pos += 2
+        if msg_type == 0x90 and b > 0:
+            events.append((tick, 'on', channel, a, b))
+        elif msg_type == 0x80 or msg_type == 0x90:
+            events.append((tick, 'off', channel, a, b))
+    return events
+
+
+def read_midi_notes(filename):
+    '''
+    returns list of (onset_sec, offset_sec, midi_pitch, velocity), sorted by onset
+    '''
+    with open(filename, 'rb') as f:
+        data = f.read()
+    if data[:4] != b'MThd':
+        raise ValueError('{} is not a Standard MIDI File'.format(filename))
+    header_length = struct.unpack('>I', data[4:8])[0]
+    _, num_tracks, division = struct.unpack('>HHH', data[8:14])
+    if division & 0x8000:
+        raise ValueError('SMPTE time division is not supported')
+
+    events = []
+    pos = 8 + header_length
+    for _ in range(num_tracks):
+        chunk_type = data[pos:pos + 4]
+        chunk_length = struct.unpack('>I', data[pos + 4:pos + 8])[0]
+        if chunk_type == b'MTrk':
+            events += _read_track(data[pos + 8:pos + 8 + chunk_length])
+        pos += 8 + chunk_length
+    # tempo changes first so that a tempo at the same tick applies to the notes at that tick
+    events.sort(key=lambda x: (x[0], x[1] != 'tempo', x[1] == 'on'))
+
+    notes = []
+    active = {}
+    tempo = 500000
+    last_tick = 0
+    seconds = 0.0
+    for tick, kind, channel, a, b in events:
+        seconds += (tick - last_tick) * tempo / division / 1e6
+        last_tick = tick
+        if kind == 'tempo':
+            tempo = a
+        elif kind == 'on':
+            active.setdefault((channel, a), []).append((seconds, b))
+        elif active.get((channel, a)):
+            onset, velocity = active[(channel, a)].pop(0)
+            notes.append((onset, seconds, a, velocity))
+    for (channel, pitch), starts in active.items():
+        for onset, velocity in starts:
+            notes.append((onset, seconds, pitch, velocity))
+    notes.sort()
+    return notes
+
+
+def _var_len(value):
+    out = [value & 0x7F]
+    value >>= 7
+    while value:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    return bytes(reversed(out))
+
+
+def write_midi_notes(filename, notes, ticks_per_beat=480, tempo=500000):
+    '''
+    notes: list of (onset_sec, offset_sec, midi_pitch, velocity)
+    writes a single track Standard MIDI File (format 0)
+    '''
+    ticks_per_sec = ticks_per_beat * 1e6 / tempo
+    events = []
+    for onset, offset, pitch, velocity in notes:
+        on_tick = int(round(onset * ticks_per_sec))
+        off_tick = max(on_tick + 1, int(round(offset * ticks_per_sec)))
+        events.append((on_tick, 1, bytes([0x90, int(pitch), int(velocity)])))
+        events.append((off_tick, 0, bytes([0x80, int(pitch), 0])))
+    # note offs first, so that a repeated note does not get cut by the previous one
+    events.sort(key=lambda x: (x[0], x[1]))
+
+    track = _var_len(0) + bytes([0xFF, 0x51, 0x03]) + tempo.to_bytes(3, 'big')
+    last_tick = 0
+    for tick, _, message in events:
+        track += _var_len(tick - last_tick) + message
+        last_tick = tick
+    track += _var_len(0) + bytes([0xFF, 0x2F, 0x00])
+
+    with open(filename, 'wb') as f:
+        f.write(b'MThd' + struct.pack('>IHHH', 6, 0, 1, ticks_per_beat))
+        f.write(b'MTrk' + struct.pack('>I', len(track)) + track)
@@ -0,0 +1,67 @@
+import argparse
+import sys
+from collections import Counter
+
+import numpy as np
+
+from transcribe import load_model, OnlineTranscriber
+from session_recorder import load_recording, EVENT_ONSET, EVENT_OFFSET
+
+""" Feeds a session recorded by SessionRecorder back through OnlineTranscriber
+and diffs the events against the recorded ones. """
+
+
+def replay(model, meta, pcm):
+    '''
+    returns list of (frame, kind, pitch), in the order they were emitted
+    '''
+    transcriber = OnlineTranscriber(model, return_roll=False)
+    channels = meta['channels']
+    hop = meta['chunk'] * channels
+    events = []
+    for frame in range(len(pcm) // hop):
+        # same decoding as get_buffer_and_transcribe in run_on_web.py
+        decoded = np.asarray(pcm[frame * hop:(frame + 1) * hop]) / 32768
+        if channels > 1:
+            decoded = decoded.reshape(-1, channels)
+            decoded = np.mean(decoded, axis=1)
+        onsets, offsets = transcriber.inference(decoded)
+        events += [(frame, EVENT_ONSET, pitch) for pitch in onsets]
+        events += [(frame, EVENT_OFFSET, pitch) for pitch in offsets]
+    return events
+
+
+def diff_events(recorded, replayed):
+    '''
+    returns (missing, added): recorded events absent from the replay and replayed events absent from the recording
+    '''
+    recorded, replayed = Counter(recorded), Counter(replayed)
+    return sorted((recorded - replayed).elements()), sorted((replayed - recorded).elements())
+
+
+def main(prefix, model_file):
+    meta, pcm, recorded = load_recording(prefix)
+    num_frames = len(pcm) // (meta['chunk'] * meta['channels'])
+    print(f"{prefix}: {num_frames} hops ({num_frames * meta['chunk'] / meta['rate']:.1f}s), "
+          f"{len(recorded)} recorded events{', truncated' if meta['truncated'] else ''}")
+
+    replayed = replay(load_model(model_file), meta, pcm)
+    # events of hops whose audio did not make it to disk cannot be replayed
+    recorded = [(int(frame), int(kind), int(pitch)) for frame, kind, pitch in recorded.tolist() if frame < num_frames]
+    missing, added = diff_events(recorded, replayed)
+
+    kind_names = {EVENT_ONSET: 'onset', EVENT_OFFSET: 'offset'}
+    for label, events in (('-', missing), ('+', added)):
+        for frame, kind, pitch in events:
+            print(f"{label} frame={frame} time={frame * meta['chunk'] / meta['rate']:.3f}s "
+                  f"{kind_names[kind]} midi_pitch={pitch + 21}")
+    print(f"{len(missing)} missing, {len(added)} added")
+    sys.exit(1 if missing or added else 0)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('prefix', type=str, help='recording prefix, without .json / .pcm / .events')
+    parser.add_argument('--model_file', type=str, default='model-180000.pt')
+    args = parser.parse_args()
+    main(args.prefix, args.model_file)
@@ -2,10 +2,15 @@ from flask import Flask, render_template, jsonify
 import pyaudio
 from transcribe import load_model, OnlineTranscriber
 from mic_stream import MicrophoneStream
+from session_recorder import SessionRecorder
 import numpy as np
 from threading import Thread
 import queue
 import rtmidi
+import os
+import time
+import atexit
+import itertools
 
 import logging
 log = logging.getLogger('werkzeug')
@@ -14,6 +19,9 @@ print('http://127.0.0.1:5000/')
 app = Flask(__name__)
 global Q
 Q = queue.Queue()
+# set AMT_RECORD_DIR to record every session (input audio and events), see replay_session.py
+RECORD_DIR = os.environ.get('AMT_RECORD_DIR')
+SESSION_COUNTER = itertools.count()
 
 
 
@@ -23,7 +31,8 @@ def home():
     # model = load_model(args)
     model = load_model('model-180000.pt')
     global Q
-    t1 = Thread(target=get_buffer_and_transcribe, name=get_buffer_and_transcribe, args=(model, Q))
+    # daemon, so that Ctrl-C ends the process and the atexit flush of the recorder runs
+    t1 = Thread(target=get_buffer_and_transcribe, name=get_buffer_and_transcribe, args=(model, Q), daemon=True)
     t1.start()
     return render_template('home.html')
 
@@ -53,29 +62,50 @@ def get_buffer_and_transcribe(model, q):
 
     stream = MicrophoneStream(RATE, CHUNK, CHANNELS)
     transcriber = OnlineTranscriber(model, return_roll=False)
-    with MicrophoneStream(RATE, CHUNK, CHANNELS) as stream:
-        audio_generator = stream.generator()
-        print("* recording")
-        on_pitch = []
-        while True:
-            data = stream._buff.get()
-            decoded = np.frombuffer(data, dtype=np.int16) / 32768
-            if CHANNELS > 1:
-                decoded = decoded.reshape(-1, CHANNELS)
-                decoded = np.mean(decoded, axis=1)
-            frame_output = transcriber.inference(decoded)
-            on_pitch += frame_output[0]
-            for pitch in frame_output[0]:
-                note_on = [0x90, pitch + 21, 64]
-                midiout.send_message(note_on)
-            for pitch in  frame_output[1]:
-                note_off = [0x90, pitch + 21, 0]
-                pitch_count = on_pitch.count(pitch)
-                [midiout.send_message(note_off) for i in range(pitch_count)]
-            on_pitch = [x for x in on_pitch if x not in frame_output[1]]
-            q.put(frame_output)
-            # print(sum(frame_output))
-        stream.closed = True
+    recorder = None
+    if RECORD_DIR:
+        # pid and counter keep sessions started within the same second apart
+        session_name = '{}_{}_{}'.format(time.strftime('session_%Y%m%d_%H%M%S'), os.getpid(), next(SESSION_COUNTER))
+        try:
+            recorder = SessionRecorder(os.path.join(RECORD_DIR, session_name), RATE, CHUNK, CHANNELS)
+            recorder.start()
+        except Exception as e:
+            # the recorder is a debugging aid, it must never stop the live transcription
+            print(f"* session recorder disabled: {e}")
+            recorder = None
+    if recorder is not None:
+        # the loop below only ends with the process, so flush at exit too
+        atexit.register(recorder.close)
+    try:
+        with MicrophoneStream(RATE, CHUNK, CHANNELS) as stream:
+            audio_generator = stream.generator()
+            print("* recording")
+            on_pitch = []
+            while True:
+                data = stream._buff.get()
+                decoded = np.frombuffer(data, dtype=np.int16) / 32768
+                if CHANNELS > 1:
+                    decoded = decoded.reshape(-1, CHANNELS)
+                    decoded = np.mean(decoded, axis=1)
+                frame_output = transcriber.inference(decoded)
+                if recorder is not None:
+                    recorder.record(data, frame_output[0], frame_output[1])
+                on_pitch += frame_output[0]
+                for pitch in frame_output[0]:
+                    note_on = [0x90, pitch + 21, 64]
+                    midiout.send_message(note_on)
+                for pitch in  frame_output[1]:
+                    note_off = [0x90, pitch + 21, 0]
+                    pitch_count = on_pitch.count(pitch)
+                    [midiout.send_message(note_off) for i in range(pitch_count)]
+                on_pitch = [x for x in on_pitch if x not in frame_output[1]]
+                q.put(frame_output)
+                # print(sum(frame_output))
+            stream.closed = True
+    finally:
+        if recorder is not None:
+            recorder.close()
+            atexit.unregister(recorder.close)
     print("* done recording")
 
 if __name__ == '__main__':
@@ -0,0 +1,349 @@
+import argparse
+import os
+import queue
+import sys
+import time
+from collections import deque
+from threading import Thread, Event
+
+import numpy as np
+import torch as th
+
+from transcribe import load_model, OnlineTranscriber, PipelinedTranscriber
+from autoregressive.constants import *
+
+""" Headless soak / capacity test.
+Drives N concurrent OnlineTranscriber sessions with synthetic piano-like audio, paced like a
+microphone, and tracks RSS, input queue depth, latency drift and event counts over time. """
+
+CHUNK = 512
+
+
+def get_rss_mb():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except (OSError, ValueError):
+        # no /proc (macOS, Windows): peak instead of current RSS, still catches steady growth.
+        # resource is imported here because it does not exist on Windows
+        try:
+            import resource
+        except ImportError:
+            return 0.0
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return max_rss / 2**20 if sys.platform == 'darwin' else max_rss / 2**10
+
+
+def piano_tone(rng, pitch, duration, sr=SAMPLE_RATE):
+    t = np.arange(int(duration * sr)) / sr
+    f0 = 440 * 2 ** ((pitch - 69) / 12)
+    tone = np.zeros_like(t)
+    for k in range(1, 9):
+        if k * f0 >= sr / 2:
+            break
+        # slightly stretched partials, faster decay for higher partials
+        fk = k * f0 * np.sqrt(1 + 0.0004 * k ** 2)
+        tone += np.sin(2 * np.pi * fk * t + rng.uniform(0, 2 * np.pi)) * np.exp(-t * (1.5 + 0.8 * k)) / k
+    attack = min(len(t), int(0.005 * sr))
+    tone[:attack] *= np.linspace(0, 1, attack)
+    release = min(len(t), int(0.05 * sr))
+    tone[len(t) - release:] *= np.linspace(1, 0, release)
+    return tone
+
+
+def synth_segments(rng, sr=SAMPLE_RATE):
+    '''
+    endless generator of float audio segments: chords, runs and silences.
+    Some silences are longer than the silence gate of OnlineTranscriber (patience of 100 hops).
+    '''
+    while True:
+        kind = rng.choice(['chord', 'run', 'silence'], p=[0.4, 0.35, 0.25])
+        if kind == 'silence':
+            duration = rng.choice([rng.uniform(0.2, 1.0), rng.uniform(3.5, 8.0)])
+            segment = rng.normal(0, 1e-4, int(duration * sr))
+        elif kind == 'chord':
+            duration = rng.uniform(0.3, 2.5)
+            pitches = rng.choice(np.arange(36, 97), size=rng.integers(1, 5), replace=False)
+            segment = sum(piano_tone(rng, pitch, duration, sr) for pitch in pitches)
+        else:
+            notes = [piano_tone(rng, pitch, rng.uniform(0.08, 0.3), sr)
+                     for pitch in rng.integers(48, 85, size=rng.integers(4, 12))]
+            segment = np.concatenate(notes)
+        peak = np.max(np.abs(segment))
+        if peak > 0 and kind != 'silence':
+            segment = segment / peak * rng.uniform(0.1, 0.8)
+        yield segment
+
+
+def synth_chunks(seed, chunk=CHUNK):
+    '''
+    endless generator of int16 byte chunks, as delivered by MicrophoneStream
+    '''
+    rng = np.random.default_rng(seed)
+    pending = np.zeros(0)
+    for segment in synth_segments(rng):
+        pending = np.concatenate((pending, segment))
+        while len(pending) >= chunk:
+            yield (np.clip(pending[:chunk], -1, 1) * 32767).astype(np.int16).tobytes()
+            pending = pending[chunk:]
+
+
+class SoakSession:
+    def __init__(self, model, seed, speed, stop_event, poll_interval=0.016, pipelined=False):
+        self.transcriber = OnlineTranscriber(model, return_roll=False)
+        # with a pipeline, consume() submits hops and collect() handles the outputs
+        self.pipe = PipelinedTranscriber(self.transcriber) if pipelined else None
+        self.pending = deque()
+        self.consume_done = Event()
+        self.buff = queue.Queue()
+        # plays the role of Q in run_on_web.py, drained by poll() like the /_amt route
+        self.output_queue = queue.Queue()
+        self.poll_interval = poll_interval
+        self.seed = seed
+        self.hop_sec = CHUNK / SAMPLE_RATE / speed
+        self.stop_event = stop_event
+
+        # appended by the consumer, popped by the monitor; deque keeps both ends thread-safe
+        self.latencies = deque()
+        self.num_hops = 0
+        self.num_onsets = 0
+        self.num_offsets = 0
+        self.on_pitch = []
+        self.max_queue_depth = 0
+        self.max_output_queue_depth = 0
+        self.error = None
+        self.threads = [Thread(target=self.produce, daemon=True), Thread(target=self.consume, daemon=True)]
+        if self.pipe is not None:
+            self.threads.append(Thread(target=self.collect, daemon=True))
+        if self.poll_interval > 0:
+            self.threads.append(Thread(target=self.poll, daemon=True))
+
+    def start(self):
+        if self.pipe is not None:
+            self.pipe.start()
+        for thread in self.threads:
+            thread.start()
+
+    def join(self, timeout=None):
+        '''
+        returns False if a thread is still running after the timeout, e.g. a wedged pipeline
+        '''
+        for thread in self.threads:
+            thread.join(timeout)
+        return not any(thread.is_alive() for thread in self.threads)
+
+    def produce(self):
+        start = time.perf_counter()
+        for i, data in enumerate(synth_chunks(self.seed)):
+            if self.stop_event.is_set():
+                break
+            deadline = start + (i + 1) * self.hop_sec
+            delay = deadline - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            self.buff.put((deadline, data))
+        self.buff.put(None)
+
+    def consume(self):
+        try:
+            while True:
+                item = self.buff.get()
+                if item is None or self.stop_event.is_set():
+                    return
+                self.max_queue_depth = max(self.max_queue_depth, self.buff.qsize())
+                produced_at, data = item
+                decoded = np.frombuffer(data, dtype=np.int16) / 32768
+                if self.pipe is None:
+                    self.handle_output(produced_at, self.transcriber.inference(decoded))
+                else:
+                    self.pending.append(produced_at)
+                    self.pipe.submit(decoded)
+        except Exception as e:
+            self.error = e
+            self.stop_event.set()
+        finally:
+            if self.pipe is not None:
+                # joins the pipeline threads, so every submitted hop is in the output queue afterwards
+                self.pipe.close()
+            self.consume_done.set()
+
+    def collect(self):
+        try:
+            while True:
+                try:
+                    frame_output = self.pipe.get(timeout=0.1)
+                except queue.Empty:
+                    if self.consume_done.is_set() and self.pipe.output_queue.empty():
+                        return
+                    continue
+                self.handle_output(self.pending.popleft(), frame_output)
+        except Exception as e:
+            self.error = e
+            self.stop_event.set()
+
+    def handle_output(self, produced_at, frame_output):
+        onsets, offsets = frame_output
+        self.latencies.append(time.perf_counter() - produced_at)
+        self.num_hops += 1
+        self.num_onsets += len(onsets)
+        self.num_offsets += len(offsets)
+        # same bookkeeping as get_buffer_and_transcribe in run_on_web.py
+        self.on_pitch += onsets
+        self.on_pitch = [x for x in self.on_pitch if x not in offsets]
+        self.output_queue.put(frame_output)
+        self.max_output_queue_depth = max(self.max_output_queue_depth, self.output_queue.qsize())
+
+    def poll(self):
+        # same draining as the /_amt route of run_on_web.py, called by the page every 16 ms
+        while not self.stop_event.is_set():
+            time.sleep(self.poll_interval)
+            onsets = []
+            offsets = []
+            while self.output_queue.qsize() > 0:
+                rst = self.output_queue.get()
+                onsets += rst[0]
+                offsets += rst[1]
+
+    def take_latencies(self):
+        latencies = []
+        while self.latencies:
+            latencies.append(self.latencies.popleft())
+        return latencies
+
+
+def run_soak(model, num_sessions, duration, warmup, speed, report_interval, budget,
+             poll_interval=0.016, pipelined=False, verbose=True):
+    '''
+    poll_interval: seconds between drains of the output queue, <= 0 for no client at all
+    returns (passed, list of failure messages)
+    '''
+    stop_event = Event()
+    sessions = [SoakSession(model, seed, speed, stop_event, poll_interval, pipelined) for seed in range(num_sessions)]
+    hop_budget = CHUNK / SAMPLE_RATE / speed
+    for session in sessions:
+        session.start()
+
+    start = time.perf_counter()
+    baseline_rss = None
+    baseline_p50 = None
+    failures = []
+    peak_rss = 0
+    last_hops = [0] * num_sessions
+    while not stop_event.is_set():
+        time.sleep(report_interval)
+        elapsed = time.perf_counter() - start
+        rss = get_rss_mb()
+        peak_rss = max(peak_rss, rss)
+        latencies = np.concatenate([np.asarray(s.take_latencies()) for s in sessions])
+        hops = [s.num_hops for s in sessions]
+        stalled = [s.seed for s, n, last in zip(sessions, hops, last_hops) if n == last]
+        last_hops = hops
+        # a stalled session is exactly the kind of degradation to catch, not a reason to wait
+        if stalled and elapsed >= warmup:
+            failures.append(f"no hop completed in the last {report_interval:.1f}s by session(s) {stalled}")
+        if len(latencies) > 0:
+            p50, p99 = np.percentile(latencies, [50, 99])
+            depth = max(s.buff.qsize() for s in sessions)
+            output_depth = max(s.output_queue.qsize() for s in sessions)
+            max_active = max(len(s.on_pitch) for s in sessions)
+            if verbose:
+                print(f"t={elapsed:7.1f}s rss={rss:8.1f}MB queue={depth:4d} output_queue={output_depth:4d} "
+                      f"latency p50={p50 * 1000:6.1f}ms p99={p99 * 1000:6.1f}ms "
+                      f"hops={sum(s.num_hops for s in sessions)} onsets={sum(s.num_onsets for s in sessions)} "
+                      f"offsets={sum(s.num_offsets for s in sessions)} active_notes={max_active}", flush=True)
+            if elapsed >= warmup:
+                if baseline_rss is None:
+                    baseline_rss, baseline_p50 = rss, p50
+                if rss - baseline_rss > budget['rss_growth_mb']:
+                    failures.append(f"RSS grew by {rss - baseline_rss:.1f}MB after warmup")
+                if depth > budget['queue_depth']:
+                    failures.append(f"input queue depth {depth} > {budget['queue_depth']}, sessions cannot keep up")
+                if output_depth > budget['output_queue_depth']:
+                    failures.append(f"output queue depth {output_depth} > {budget['output_queue_depth']}, the poller cannot keep up")
+                if p99 > hop_budget * budget['latency_hops']:
+                    failures.append(f"p99 latency {p99 * 1000:.1f}ms > {hop_budget * budget['latency_hops'] * 1000:.1f}ms")
+                if p50 > baseline_p50 * budget['latency_drift'] and p50 > hop_budget * 0.1:
+                    failures.append(f"p50 latency drifted from {baseline_p50 * 1000:.1f}ms to {p50 * 1000:.1f}ms")
+                if max_active > budget['active_notes']:
+                    failures.append(f"{max_active} active notes in on_pitch bookkeeping")
+        if failures or elapsed >= duration:
+            break
+
+    stop_event.set()
+    for session in sessions:
+        if not session.join(timeout=max(5.0, report_interval)):
+            failures.append(f"session {session.seed} did not stop, a thread is wedged")
+        if session.error is not None:
+            failures.append(f"session {session.seed} raised {session.error!r}")
+    if verbose:
+        print(f"sessions={num_sessions} peak_rss={peak_rss:.1f}MB "
+              f"max_queue_depth={max(s.max_queue_depth for s in sessions)} "
+              f"max_output_queue_depth={max(s.max_output_queue_depth for s in sessions)} "
+              f"result={'FAIL' if failures else 'PASS'}", flush=True)
+        for failure in failures:
+            print(f"  {failure}")
+    return not failures, failures
+
+
+def main(args):
+    th.set_num_threads(args.torch_threads)
+    model = load_model(args.model_file)
+    budget = {'rss_growth_mb': args.max_rss_growth_mb,
+              'queue_depth': args.max_queue_depth,
+              'output_queue_depth': args.max_output_queue_depth,
+              'latency_hops': args.max_latency_hops,
+              'latency_drift': args.max_latency_drift,
+              'active_notes': args.max_active_notes}
+    if not args.find_capacity:
+        passed, _ = run_soak(model, args.sessions, args.duration, args.warmup, args.speed, args.report_interval, budget,
+                             args.poll_interval, args.pipelined)
+        sys.exit(0 if passed else 1)
+
+    def probe(num_sessions):
+        passed, _ = run_soak(model, num_sessions, args.capacity_duration, args.warmup, args.speed, args.report_interval,
+                             budget, args.poll_interval, args.pipelined)
+        return passed
+
+    # double the number of sessions until the budget is violated, then bisect between the last
+    # passing and the first failing count
+    capacity = 0
+    num_sessions = 1
+    while probe(num_sessions):
+        capacity = num_sessions
+        num_sessions *= 2
+    failing = num_sessions
+    while failing - capacity > 1:
+        num_sessions = (capacity + failing) // 2
+        if probe(num_sessions):
+            capacity = num_sessions
+        else:
+            failing = num_sessions
+    print(f"capacity: {capacity} sessions at {args.speed}x real-time with {args.torch_threads} torch thread(s)"
+          f"{', pipelined' if args.pipelined else ''}")
+    sys.exit(0 if capacity > 0 else 1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model_file', type=str, default='model-180000.pt')
+    parser.add_argument('--sessions', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=3600, help='seconds of wall time')
+    parser.add_argument('--warmup', type=float, default=30, help='seconds before the baselines are taken')
+    parser.add_argument('--speed', type=float, default=1.0, help='audio pace relative to real time')
+    parser.add_argument('--report_interval', type=float, default=10)
+    parser.add_argument('--poll_interval', type=float, default=0.016,
+                        help='seconds between drains of the output queue, like the web page polling /_amt; 0 for no client')
+    parser.add_argument('--torch_threads', type=int, default=1)
+    parser.add_argument('--max_rss_growth_mb', type=float, default=50)
+    parser.add_argument('--max_queue_depth', type=int, default=32)
+    parser.add_argument('--max_output_queue_depth', type=int, default=64)
+    parser.add_argument('--max_latency_hops', type=float, default=4, help='p99 latency budget in hops')
+    parser.add_argument('--max_latency_drift', type=float, default=2.0, help='allowed ratio of p50 latency to its baseline')
+    parser.add_argument('--max_active_notes', type=int, default=88)
+    parser.add_argument('--pipelined', action='store_true', help='run every session with PipelinedTranscriber')
+    parser.add_argument('--find_capacity', action='store_true',
+                        help='find the largest number of sessions that stays within the budgets, '
+                             'by doubling and then bisecting; every probe runs for --capacity_duration')
+    parser.add_argument('--capacity_duration', type=float, default=300, help='seconds of wall time of every capacity probe')
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,181 @@
+import argparse
+
+import torch as th
+import numpy as np
+
+from transcribe import load_model
+from midi_io import read_midi_notes
+from autoregressive.constants import *
+
+""" Teacher-forced scoring of a performance against a reference MIDI or piano roll.
+Every frame is conditioned on the reference state of the previous frame, so the LSTM
+runs over the whole take in one call instead of the frame-by-frame autoregressive loop. """
+
+# note states of the AR model
+OFF, OFFSET, FRAME, ONSET, REONSET = range(5)
+
+
+def notes_to_label(notes, num_frames):
+    '''
+    notes: list of (onset_sec, offset_sec, midi_pitch, ...)
+    returns np.ndarray of note states, shape of (T x 88)
+    '''
+    label = np.zeros((num_frames, MAX_MIDI - MIN_MIDI + 1), dtype=np.int64)
+    for note in sorted(notes):
+        onset, offset, pitch = note[:3]
+        f = int(pitch) - MIN_MIDI
+        if not 0 <= f < label.shape[1]:
+            continue
+        left = int(round(onset * SAMPLE_RATE / HOP_LENGTH))
+        if left >= num_frames:
+            continue
+        onset_right = min(num_frames, left + HOPS_IN_ONSET)
+        frame_right = max(onset_right, min(num_frames, int(round(offset * SAMPLE_RATE / HOP_LENGTH))))
+        offset_right = min(num_frames, frame_right + HOPS_IN_OFFSET)
+        sustained = left > 0 and label[left - 1, f] in (FRAME, ONSET, REONSET)
+        label[left:onset_right, f] = REONSET if sustained else ONSET
+        label[onset_right:frame_right, f] = FRAME
+        label[frame_right:offset_right, f] = OFFSET
+    return label
+
+
+def roll_to_label(roll):
+    '''
+    roll: binary piano roll, shape of (T x 88)
+    returns np.ndarray of note states, shape of (T x 88)
+    '''
+    roll = np.asarray(roll) > 0
+    prev = np.concatenate((np.zeros_like(roll[:1]), roll[:-1]), axis=0)
+    label = np.zeros(roll.shape, dtype=np.int64)
+    label[roll] = FRAME
+    label[roll & ~prev] = ONSET
+    label[~roll & prev] = OFFSET
+    return label
+
+
+class PerformanceScorer:
+    '''
+    The model has to be a fresh one from load_model(), not one that is shared with an
+    OnlineTranscriber, which strips the time padding of the convolution layers.
+    '''
+    def __init__(self, model, onset_threshold=0.5, tolerance=2, batch_size=8):
+        for i in (0, 3, 8):
+            if tuple(model.acoustic_model.cnn[i].padding) != (1, 1):
+                raise ValueError('model is set up for OnlineTranscriber; load a separate model for scoring')
+        self.model = model
+        self.model.eval()
+        self.onset_threshold = onset_threshold
+        self.tolerance = tolerance
+        self.batch_size = batch_size
+
+    def audio_to_mel(self, audio):
+        # the mel frontend uses center=False; reflect-pad like the training STFT did,
+        # so that frame t is centred at t * HOP_LENGTH, which is where notes_to_label puts it
+        audio = np.pad(np.clip(audio, -1, 1), (WINDOW_LENGTH // 2, WINDOW_LENGTH // 2), mode='reflect')
+        audio = th.tensor(audio).to(th.float)
+        return self.model.melspectrogram(audio.unsqueeze(0))[0].transpose(0, 1)
+
+    def make_label(self, reference, num_frames):
+        if isinstance(reference, str):
+            reference = read_midi_notes(reference)
+        if isinstance(reference, np.ndarray):
+            label = roll_to_label(reference)[:num_frames]
+            return np.pad(label, ((0, num_frames - len(label)), (0, 0)))
+        return notes_to_label(reference, num_frames)
+
+    def log_probs(self, mels, labels):
+        '''
+        mels: list of tensors, shape of (T_i x n_mels)
+        labels: list of np.ndarray, shape of (T_i x 88)
+        returns list of log probabilities of the 5 note states, shape of (T_i x 88 x 5)
+        '''
+        lengths = [len(mel) for mel in mels]
+        max_len = max(lengths)
+        batch_label = th.zeros((len(mels), max_len, MAX_MIDI - MIN_MIDI + 1), dtype=th.long)
+        for i, label in enumerate(labels):
+            batch_label[i, :lengths[i]] = th.from_numpy(label)
+        with th.no_grad():
+            # the CNN pads in time, so it runs per take to keep the last frames independent of the batch.
+            # Only its output is padded: the LSTM is causal, padding after a take cannot reach back into it
+            acoustic_out = th.zeros((len(mels), max_len, self.model.acoustic_model.fc[0].out_features))
+            for i, mel in enumerate(mels):
+                acoustic_out[i, :lengths[i]] = self.model.acoustic_model(mel.unsqueeze(0))[0]
+            logits = self.model.lm_model_teacher_forced(acoustic_out, batch_label)
+            log_probs = th.log_softmax(logits, dim=3)
+        return [log_probs[i, :lengths[i]].numpy() for i in range(len(mels))]
+
+    def find_errors(self, onset_prob, label):
+        '''
+        returns missed reference onsets and extra onsets of the performance,
+        both as lists of (time_sec, midi_pitch)
+        '''
+        tol = self.tolerance
+        ref_onset = (label == ONSET) | (label == REONSET)
+        detected = onset_prob >= self.onset_threshold
+        padded_detected = np.pad(detected, ((tol, tol), (0, 0)))
+        padded_ref = np.pad(ref_onset, ((tol, tol), (0, 0)))
+        window = 2 * tol + 1
+        near_detected = np.zeros_like(detected)
+        near_ref = np.zeros_like(ref_onset)
+        for k in range(window):
+            near_detected |= padded_detected[k:k + len(detected)]
+            near_ref |= padded_ref[k:k + len(ref_onset)]
+        rising = detected & ~np.concatenate((np.zeros_like(detected[:1]), detected[:-1]), axis=0)
+
+        def to_events(mask):
+            frames, pitches = np.nonzero(mask)
+            return [(frame * HOP_LENGTH / SAMPLE_RATE, pitch + MIN_MIDI) for frame, pitch in zip(frames.tolist(), pitches.tolist())]
+
+        return to_events(ref_onset & ~near_detected), to_events(rising & ~near_ref)
+
+    def score(self, audios, references):
+        '''
+        audios: list of 1-D float arrays at SAMPLE_RATE in range [-1, 1]
+        references: list of MIDI file names, note lists or binary piano rolls (T x 88)
+        returns list of dicts, one per take
+        '''
+        results = []
+        for start in range(0, len(audios), self.batch_size):
+            mels = [self.audio_to_mel(audio) for audio in audios[start:start + self.batch_size]]
+            labels = [self.make_label(reference, len(mel)) for mel, reference in zip(mels, references[start:start + self.batch_size])]
+            for log_probs, label in zip(self.log_probs(mels, labels), labels):
+                log_likelihood = np.take_along_axis(log_probs, label[..., None], axis=2)[..., 0]
+                onset_prob = np.exp(log_probs[..., ONSET]) + np.exp(log_probs[..., REONSET])
+                missed, extra = self.find_errors(onset_prob, label)
+                results.append({'log_likelihood': log_likelihood,
+                                'onset_prob': onset_prob,
+                                'label': label,
+                                'mean_log_likelihood': float(log_likelihood.mean()),
+                                'missed': missed,
+                                'extra': extra})
+        return results
+
+
+def main(audio_files, references, model_file, onset_threshold, tolerance, batch_size):
+    import librosa
+
+    if len(audio_files) != len(references):
+        raise ValueError('Got {} audio files but {} references'.format(len(audio_files), len(references)))
+    audios = [librosa.load(audio_file, sr=SAMPLE_RATE, mono=True)[0] for audio_file in audio_files]
+    references = [np.load(ref) if ref.endswith('.npy') else ref for ref in references]
+
+    scorer = PerformanceScorer(load_model(model_file), onset_threshold, tolerance, batch_size)
+    for audio_file, result in zip(audio_files, scorer.score(audios, references)):
+        print(f"{audio_file}: mean log-likelihood={result['mean_log_likelihood']:.4f}, "
+              f"missed={len(result['missed'])}, extra={len(result['extra'])}")
+        for t, pitch in result['missed']:
+            print(f"  Missed: time={t:.3f}s, midi_pitch={pitch}")
+        for t, pitch in result['extra']:
+            print(f"  Extra: time={t:.3f}s, midi_pitch={pitch}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--audio_files', type=str, nargs='+', required=True)
+    parser.add_argument('--references', type=str, nargs='+', required=True, help='MIDI files or piano rolls (.npy, T x 88)')
+    parser.add_argument('--model_file', type=str, default='model-180000.pt')
+    parser.add_argument('--onset_threshold', type=float, default=0.5)
+    parser.add_argument('--tolerance', type=int, default=2, help='onset tolerance in frames')
+    parser.add_argument('--batch_size', type=int, default=8)
+    args = parser.parse_args()
+    main(args.audio_files, args.references, args.model_file, args.onset_threshold, args.tolerance, args.batch_size)
@@ -0,0 +1,161 @@
+import json
+import os
+from threading import Thread, Event
+
+import numpy as np
+
+""" Opt-in recorder of a live session: raw int16 input and the emitted onset / offset events.
+record() only copies into preallocated ring buffers; a background thread appends them to
+<prefix>.pcm and <prefix>.events, both of which can be opened with np.memmap (see load_recording). """
+
+EVENT_DTYPE = np.dtype([('frame', '<i8'), ('kind', 'u1'), ('pitch', 'u1')])
+EVENT_ONSET = 1
+EVENT_OFFSET = 2
+
+
+class SessionRecorder:
+    def __init__(self, prefix, rate, chunk, channels, buffer_sec=30, event_capacity=2**16, flush_interval=0.5):
+        self.prefix = prefix
+        self.meta = {'rate': rate, 'chunk': chunk, 'channels': channels, 'pcm_dtype': '<i2',
+                     'event_dtype': EVENT_DTYPE.descr, 'truncated': False}
+        self.pcm = np.zeros(int(buffer_sec * rate) * channels, dtype='<i2')
+        self.events = np.zeros(event_capacity, dtype=EVENT_DTYPE)
+        # monotonic counters; the ring position is counter % capacity
+        self.pcm_written = 0
+        self.pcm_flushed = 0
+        self.events_written = 0
+        self.events_flushed = 0
+        self.frame = 0
+        self.truncated = False
+
+        self.flush_interval = flush_interval
+        self.wake = Event()
+        self.stop_event = Event()
+        self.thread = Thread(target=self._run_writer, name='session_recorder', daemon=True)
+        self.closed = False
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def start(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.prefix)), exist_ok=True)
+        # frame indices restart at 0 for every session, so never append to an existing recording
+        if os.path.exists(self.prefix + '.json'):
+            raise FileExistsError('recording {} already exists'.format(self.prefix))
+        self.pcm_file = open(self.prefix + '.pcm', 'xb')
+        try:
+            self.events_file = open(self.prefix + '.events', 'xb')
+            self._write_meta()
+        except Exception:
+            self.pcm_file.close()
+            if hasattr(self, 'events_file'):
+                self.events_file.close()
+            raise
+        self.thread.start()
+
+    def close(self):
+        '''
+        flushes everything recorded so far; safe to call more than once
+        '''
+        if self.closed:
+            return
+        self.closed = True
+        self.stop_event.set()
+        self.wake.set()
+        self.thread.join()
+        self.pcm_file.close()
+        self.events_file.close()
+
+    def record(self, data, onsets, offsets):
+        '''
+        data: raw int16 input of one hop (bytes or np.ndarray, interleaved channels)
+        onsets, offsets: output of OnlineTranscriber.inference(return_roll=False) for that hop
+        Never blocks. If the writer falls behind and a ring buffer is full, recording stops,
+        so that the files always hold a consistent prefix of the session.
+        '''
+        if self.truncated:
+            return
+        samples = np.frombuffer(data, dtype='<i2') if isinstance(data, bytes) else np.asarray(data, dtype='<i2').ravel()
+        num_events = len(onsets) + len(offsets)
+        if (self.pcm_written + len(samples) - self.pcm_flushed > len(self.pcm)
+                or self.events_written + num_events - self.events_flushed > len(self.events)):
+            self.truncated = True
+            self.wake.set()
+            return
+
+        start = self.pcm_written % len(self.pcm)
+        first = min(len(samples), len(self.pcm) - start)
+        self.pcm[start:start + first] = samples[:first]
+        self.pcm[:len(samples) - first] = samples[first:]
+
+        index = self.events_written
+        for kind, pitches in ((EVENT_ONSET, onsets), (EVENT_OFFSET, offsets)):
+            for pitch in pitches:
+                self.events[index % len(self.events)] = (self.frame, kind, pitch)
+                index += 1
+        # publish only after the data is in place; the writer never reads past these counters
+        self.pcm_written += len(samples)
+        self.events_written = index
+        self.frame += 1
+
+    def _write_meta(self):
+        self.meta['truncated'] = self.truncated
+        tmp_path = self.prefix + '.json.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.meta, f)
+        os.replace(tmp_path, self.prefix + '.json')
+
+    @staticmethod
+    def _drain(ring, begin, end, f):
+        start = begin % len(ring)
+        count = end - begin
+        first = min(count, len(ring) - start)
+        f.write(ring[start:start + first].tobytes())
+        f.write(ring[:count - first].tobytes())
+
+    def _flush(self):
+        pcm_end, events_end = self.pcm_written, self.events_written
+        # events first: after a crash, events past the end of the pcm file are ignored by the replay
+        if events_end > self.events_flushed:
+            self._drain(self.events, self.events_flushed, events_end, self.events_file)
+            self.events_file.flush()
+            self.events_flushed = events_end
+        if pcm_end > self.pcm_flushed:
+            self._drain(self.pcm, self.pcm_flushed, pcm_end, self.pcm_file)
+            self.pcm_file.flush()
+            self.pcm_flushed = pcm_end
+
+    def _run_writer(self):
+        meta_truncated = False
+        while True:
+            stopping = self.stop_event.is_set()
+            self._flush()
+            if self.truncated and not meta_truncated:
+                self._write_meta()
+                meta_truncated = True
+            if stopping:
+                return
+            self.wake.wait(self.flush_interval)
+            self.wake.clear()
+
+
+def load_recording(prefix):
+    '''
+    returns (meta, pcm, events), pcm and events as read-only memory maps
+    '''
+    with open(prefix + '.json') as f:
+        meta = json.load(f)
+
+    def memmap(filename, dtype):
+        if os.path.getsize(filename) < dtype.itemsize:
+            return np.zeros(0, dtype=dtype)
+        count = os.path.getsize(filename) // dtype.itemsize
+        return np.memmap(filename, dtype=dtype, mode='r', shape=(count,))
+
+    pcm = memmap(prefix + '.pcm', np.dtype(meta['pcm_dtype']))
+    events = memmap(prefix + '.events', EVENT_DTYPE)
+    return meta, pcm, events
@@ -1,13 +1,29 @@
 
 
 
-import librosa
 import numpy as np
-from transcribe import load_model, OnlineTranscriber
+from transcribe import load_model, OnlineTranscriber, PipelinedTranscriber
 import argparse
+import sys
 import time
 
-def main(audio_file, model_file):
+def check_pipelined(model, frames):
+    '''
+    runs the frames through the serial and the pipelined path with fresh transcribers
+    returns the indices of the frames whose outputs differ
+    '''
+    transcriber = OnlineTranscriber(model, return_roll=False)
+    serial_outputs = [transcriber.inference(frame) for frame in frames]
+    with PipelinedTranscriber(OnlineTranscriber(model, return_roll=False)) as pipe:
+        pipelined_outputs = list(pipe.map(frames))
+    if len(serial_outputs) != len(pipelined_outputs):
+        return list(range(min(len(serial_outputs), len(pipelined_outputs)), max(len(serial_outputs), len(pipelined_outputs))))
+    return [i for i, (a, b) in enumerate(zip(serial_outputs, pipelined_outputs)) if a != b]
+
+
+def main(audio_file, model_file, pipelined=False, check=False):
+    import librosa
+
     y, sr = librosa.load(audio_file, sr=16000, mono=True)
     print(f"Loaded {audio_file}: {y.shape}, sr={sr}")
 
@@ -19,12 +35,22 @@ def main(audio_file, model_file):
     hop_size = 512
     n_frames = (len(y) - frame_size) // hop_size + 1
 
+    frames = [y[i*hop_size:i*hop_size+frame_size] for i in range(n_frames)]
+    if check:
+        mismatches = check_pipelined(model, frames)
+        print(f"Pipelined output {'differs at frames ' + str(mismatches) if mismatches else 'is identical'} "
+              f"to the serial output over {len(frames)} frames")
+        sys.exit(1 if mismatches else 0)
+
+    if pipelined:
+        pipe = PipelinedTranscriber(transcriber)
+        pipe.start()
+        outputs = pipe.map(frames)
+    else:
+        outputs = (transcriber.inference(frame) for frame in frames)
+
     current_time = 0.0
-    for i in range(n_frames):
-        frame = y[i*hop_size:i*hop_size+frame_size]
-        if len(frame) < frame_size:
-            break
-        onsets, offsets = transcriber.inference(frame)
+    for i, (onsets, offsets) in enumerate(outputs):
         t = (i * hop_size) / sr
         # Ensure onsets/offsets are always lists
         if isinstance(onsets, int):
@@ -41,6 +67,8 @@ def main(audio_file, model_file):
         # Optional: simulate real-time by sleeping for frame duration
         # time.sleep(hop_size / sr)
 
+    if pipelined:
+        pipe.close()
     print("Done streaming audio file.")
 
 if __name__ == '__main__':
@@ -49,5 +77,7 @@ if __name__ == '__main__':
     # The corresponding MIDI note should be: 60, 64, 67, 72, 60
     parser.add_argument('--audio_file', type=str, default='audio-test.mp3')
     parser.add_argument('--model_file', type=str, default='model-180000.pt')
+    parser.add_argument('--pipelined', action='store_true', help='run the frontend and the LSTM on separate threads')
+    parser.add_argument('--check_pipelined', action='store_true', help='check that the pipelined output is identical to the serial one')
     args = parser.parse_args()
-    main(args.audio_file, args.model_file)
+    main(args.audio_file, args.model_file, args.pipelined, args.check_pipelined)
@@ -5,6 +5,8 @@ import tempfile
 import shutil
 import subprocess
 import math
+import queue
+from threading import Thread
 
 import torch as th
 import torch.nn.functional as F
@@ -89,6 +91,14 @@ class OnlineTranscriber:
             self.num_under_thr = 0
 
     def inference(self, audio):
+        return self.lm_step(self.frontend_step(audio))
+
+    def frontend_step(self, audio):
+        '''
+        audio buffer, mel and CNN update for one hop. Does not depend on the previous LSTM output,
+        so it can run ahead of lm_step (see PipelinedTranscriber).
+        returns acoustic_out, or None if the input is gated as silence
+        '''
         # time_list = []
         with th.no_grad():
             # time_list.append(time())
@@ -97,15 +107,20 @@ class OnlineTranscriber:
             self.switch_on_or_off()
             # time_list.append(time())
             if self.num_under_thr > self.patience:
-                if self.return_roll:
-                    return [0]*88
-                else:
-                    return [], []
+                return None
             self.update_mel_buffer()
             # time_list.append(time())
-            acoustic_out = self.update_acoustic_out(self.mel_buffer.transpose(-1, -2))
+            return self.update_acoustic_out(self.mel_buffer.transpose(-1, -2))
             # time_list.append(time())
             # acoustic_out = self.model.acoustic_model(self.mel_buffer.transpose(-1, -2))
+
+    def lm_step(self, acoustic_out):
+        if acoustic_out is None:
+            if self.return_roll:
+                return [0]*88
+            else:
+                return [], []
+        with th.no_grad():
             language_out, self.hidden = self.model.lm_model_step(acoustic_out, self.hidden, self.prev_output)
             # language_out, self.hidden = self.model.lm_model_step(acoustic_out[:,3:4,:], self.hidden, self.prev_output)
             language_out[0,0,:,3:5] *= 2
@@ -134,6 +149,102 @@ class OnlineTranscriber:
         # return acoustic_out[:,3:4,:].numpy()
 
 
+class PipelinedTranscriber:
+    '''
+    Runs OnlineTranscriber.frontend_step (audio buffer, mel, CNN) and lm_step (LSTM) on two threads
+    connected by small bounded queues, so that the frontend of hop t+1 overlaps the LSTM of hop t.
+    Each stage owns its part of the transcriber state and hops are processed in order,
+    so the outputs are identical to calling transcriber.inference() serially.
+    The transcriber must not be used directly while the pipeline is running.
+
+    with PipelinedTranscriber(transcriber) as pipe:
+        pipe.submit(audio)
+        frame_output = pipe.get()
+    '''
+    _STOP = object()
+
+    def __init__(self, transcriber, queue_size=4):
+        self.transcriber = transcriber
+        self.input_queue = queue.Queue(maxsize=queue_size)
+        self.acoustic_queue = queue.Queue(maxsize=queue_size)
+        self.output_queue = queue.Queue()
+        self.threads = [Thread(target=self._run_frontend, name='amt_frontend', daemon=True),
+                        Thread(target=self._run_lm, name='amt_lm', daemon=True)]
+        self.running = False
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+        self.running = True
+
+    def close(self):
+        if self.running:
+            self.input_queue.put(self._STOP)
+            for thread in self.threads:
+                thread.join()
+            self.running = False
+
+    def _run_frontend(self):
+        while True:
+            audio = self.input_queue.get()
+            if audio is self._STOP:
+                self.acoustic_queue.put(self._STOP)
+                return
+            try:
+                self.acoustic_queue.put(self.transcriber.frontend_step(audio))
+            except Exception as e:
+                self.acoustic_queue.put(e)
+
+    def _run_lm(self):
+        while True:
+            acoustic_out = self.acoustic_queue.get()
+            if acoustic_out is self._STOP:
+                return
+            if isinstance(acoustic_out, Exception):
+                self.output_queue.put(acoustic_out)
+                continue
+            try:
+                self.output_queue.put(self.transcriber.lm_step(acoustic_out))
+            except Exception as e:
+                self.output_queue.put(e)
+
+    def submit(self, audio):
+        '''
+        blocks only while the pipeline is full
+        '''
+        self.input_queue.put(audio)
+
+    def get(self, block=True, timeout=None):
+        '''
+        returns the output of the oldest submitted hop, same format as OnlineTranscriber.inference
+        '''
+        frame_output = self.output_queue.get(block=block, timeout=timeout)
+        if isinstance(frame_output, Exception):
+            raise frame_output
+        return frame_output
+
+    def map(self, frames):
+        '''
+        yields the output of every frame, in order
+        '''
+        num_pending = 0
+        for audio in frames:
+            self.submit(audio)
+            num_pending += 1
+            while not self.output_queue.empty():
+                num_pending -= 1
+                yield self.get()
+        for _ in range(num_pending):
+            yield self.get()
+
+
 def load_model(filename):
     parameters = th.load(filename, map_location=th.device('cpu'))
     model = models.AR_Transcriber(229,